@@ -1,16 +1,53 @@
 from typing import Tuple, List, Callable, Set, Dict, Optional
-from model_player import ModelPlayer, ModelConfig
+from model_player import ModelPlayer, ModelConfig, ResponseCache, LRUCache, legal_san_table, position_key
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 import chess
 import chess.pgn
 import random
-import json
+import orjson
+import gzip
+import os
+import sys
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import combinations
 
 from models import ProviderType
 
+_PIECE_SYMBOLS = [(piece_type, color, chess.Piece(piece_type, color).symbol()) for color in chess.COLORS for piece_type in chess.PIECE_TYPES]
+
+def _render_ascii(board: chess.Board) -> str:
+    cells = ['.'] * 64
+    for piece_type, color, symbol in _PIECE_SYMBOLS:
+        for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+            cells[square ^ 56] = symbol
+    return '\n'.join(' '.join(cells[i:i + 8]) for i in range(0, 64, 8))
+
+def _is_game_over(board: chess.Board) -> bool:
+    # Fivefold repetition needs 16+ reversible plies (and the 75-move rule 150), so until then only
+    # mate, stalemate and insufficient material can end the game; this skips is_game_over()'s
+    # repetition scan over the whole move stack on most plies
+    if board.halfmove_clock < 16:
+        return board.is_insufficient_material() or not any(board.generate_legal_moves())
+    return board.is_game_over()
+
+_FENS = LRUCache()
+
+def _cached_fen(board: chess.Board) -> str:
+    key = (position_key(board), board.halfmove_clock, board.fullmove_number)
+    fen = _FENS.get(key)
+    if fen is None:
+        fen = board.fen()
+        _FENS.put(key, fen)
+    return fen
+
+def _default_stringifier(board: chess.Board) -> str:
+    legal = ', '.join(san for san, _ in legal_san_table(board).values())
+    return f"{_render_ascii(board)}\nLegal: {legal}"
+
 
 class EloCalculator:
     @staticmethod
@@ -31,13 +68,19 @@ class EloCalculator:
 
         return white_rating + white_change, black_rating + black_change
 
+_RESULT_STRINGS: Tuple[str, str, str] = ("0-1", "1/2-1/2", "1-0")
+
+_COLD_FIELDS = ('reasonings', 'fens', 'pgn')
+
 @dataclass
 class Game:
     white: ModelConfig
     black: ModelConfig
     moves: List[str] = field(default_factory=list)
     reasonings: List[str] = field(default_factory=list)
+    fens: List[str] = field(default_factory=list)
     result: float = 0.5  # 1.0 = white win, 0.0 = black win, 0.5 = draw
+    _pgn_cache: Optional[str] = field(default=None, repr=False, compare=False)
 
     def to_pgn(self) -> chess.pgn.Game:
         pgn = chess.pgn.Game()
@@ -46,7 +89,7 @@ class Game:
         pgn.headers["Black"] = self.black.label
         pgn.headers["WhiteElo"] = str(int(self.white.elo))
         pgn.headers["BlackElo"] = str(int(self.black.elo))
-        pgn.headers["Result"] = ["0-1", "1/2-1/2", "1-0"][int(self.result * 2)]
+        pgn.headers["Result"] = _RESULT_STRINGS[int(self.result * 2)]
 
         board = chess.Board()
         node = pgn
@@ -59,110 +102,256 @@ class Game:
 
         return pgn
 
+    def pgn_text(self) -> str:
+        if self._pgn_cache is None:
+            self._pgn_cache = str(self.to_pgn())
+        return self._pgn_cache
+
     def to_dict(self) -> dict:
-            return {
+            data = {
                 'white_label': self.white.label,
                 'black_label': self.black.label,
-                'moves': self.moves,
-                'reasonings': self.reasonings,
-                'result': self.result
+                'moves': ' '.join(self.moves),
+                'fens': self.fens,
+                'result': self.result,
+                'pgn': self.pgn_text()
             }
+            if any(r and r != 'No reasoning' for r in self.reasonings):
+                data['reasonings'] = self.reasonings
+            return data
 
     @classmethod
     def from_dict(cls, data: dict, player_map: dict) -> 'Game':
+        moves = data['moves'].split()
         return cls(
             white=player_map[data['white_label']],
             black=player_map[data['black_label']],
-            moves=data['moves'],
-            reasonings=data['reasonings'],
-            result=data['result']
+            moves=moves,
+            reasonings=data.get('reasonings') or ['No reasoning'] * len(moves),
+            fens=data.get('fens', []),
+            result=data['result'],
+            _pgn_cache=data.get('pgn')
         )
 
 class League:
-    def __init__(self, players: List[ModelConfig], max_retries: int = 3, stringifier = None):
+    def __init__(self, players: List[ModelConfig], max_retries: int = 3, stringifier = None, cache_responses: bool = True, max_concurrency: Optional[int] = None,
+                 cache_path: Optional[Path] = None):
         self.players = players
         self.max_retries = max_retries
-        self.stringifier = stringifier or (lambda b: f"{b}\nLegal: {', '.join(b.san(m) for m in b.legal_moves)}")
+        self.max_concurrency = max_concurrency
+        self.response_cache = ResponseCache(cache_path) if cache_responses else None
+        self.stringifier = stringifier or _default_stringifier
+        self._players: Dict[str, ModelPlayer] = {}
         self.games: List[Game] = []
-        self.completed_games: Set[Tuple[str, str]] = set()
+        self._player_id: Dict[str, int] = {p.label: i for i, p in enumerate(players)}
+        self._completed = bytearray((len(players) * len(players) + 7) // 8)
+        self._lock = threading.Lock()
+        self._saved_games = 0
+
+    def _completed_bit(self, white: ModelConfig, black: ModelConfig) -> Tuple[int, int]:
+        return divmod(self._player_id[white.label] * len(self.players) + self._player_id[black.label], 8)
+
+    def _is_completed(self, white: ModelConfig, black: ModelConfig) -> bool:
+        byte, bit = self._completed_bit(white, black)
+        return bool(self._completed[byte] & (1 << bit))
+
+    def _mark_completed(self, white: ModelConfig, black: ModelConfig):
+        byte, bit = self._completed_bit(white, black)
+        self._completed[byte] |= 1 << bit
+
+    @property
+    def completed_games(self) -> Set[Tuple[str, str]]:
+        return {(w.label, b.label) for w in self.players for b in self.players if w is not b and self._is_completed(w, b)}
+
+    def _player(self, cfg: ModelConfig) -> ModelPlayer:
+        player = self._players.get(cfg.label)
+        if player is None:
+            with self._lock:
+                player = self._players.get(cfg.label)
+                if player is None:
+                    player = self._players[cfg.label] = ModelPlayer(cfg, self.max_retries, self.stringifier, self.response_cache)
+        return player
+
+    def _record_move(self, board: chess.Board, game: Game, move_history: List[str], move: chess.Move, san: str, reasoning: str):
+        game.moves.append(san)
+        game.reasonings.append(reasoning)
+        game.fens.append(board.fen())
+
+        move_num = (len(game.moves) + 1) // 2
+        move_history.append(f"{move_num}. {san} " if board.turn else f"{san} ")
+
+        board.push(move)
+
+    def _finish_game(self, board: chess.Board, game: Game) -> Game:
+        if board.is_checkmate():
+            game.result = 0.0 if board.turn else 1.0
+
+        with self._lock:
+            sys.stdout.write(f"{game.white.label} vs {game.black.label}: {' '.join(game.moves)}\n")
+        return game
 
     def play_game(self, white: ModelConfig, black: ModelConfig) -> Game:
         board = chess.Board()
         game = Game(white, black)
 
-        white_player = ModelPlayer(white, self.max_retries, self.stringifier)
-        black_player = ModelPlayer(black, self.max_retries, self.stringifier)
+        white_player = self._player(white)
+        black_player = self._player(black)
 
-        move_history = ""
-        while not board.is_game_over():
+        move_history: List[str] = []
+        while not _is_game_over(board):
             player = white_player if board.turn else black_player
-            move, reasoning = player.get_move(board, move_history)
-            san = board.san(move)
-            game.moves.append(san)
-            game.reasonings.append(reasoning)
+            move, san, reasoning = player.get_move(board, move_history)
+            self._record_move(board, game, move_history, move, san, reasoning)
 
-            move_num = (len(game.moves) + 1) // 2
-            move_history += f"{move_num}. {san} " if board.turn else f"{san} "
+        return self._finish_game(board, game)
 
-            board.push(move)
-            print(san + '\n')
+    async def aplay_game(self, white: ModelConfig, black: ModelConfig) -> Game:
+        board = chess.Board()
+        game = Game(white, black)
 
-        if board.is_checkmate():
-            game.result = 0.0 if board.turn else 1.0
+        white_player = self._player(white)
+        black_player = self._player(black)
 
-        return game
+        move_history: List[str] = []
+        while not _is_game_over(board):
+            player = white_player if board.turn else black_player
+            move, san, reasoning = await player.aget_move(board, move_history)
+            self._record_move(board, game, move_history, move, san, reasoning)
 
-    def run(self):
-        for p1, p2 in combinations(self.players, 2):
-            print(f"\n{p1.label} vs {p2.label}")
+        return self._finish_game(board, game)
 
+    def _schedule(self) -> List[Tuple[ModelConfig, ModelConfig]]:
+        schedule: List[Tuple[ModelConfig, ModelConfig]] = []
+        for p1, p2 in combinations(self.players, 2):
             if random.random() < 0.5:
                 white1, black1 = p1, p2
             else:
                 white1, black1 = p2, p1
 
-            if (white1.label, black1.label) not in self.completed_games:
-                game1 = self.play_game(white1, black1)
-                self.games.append(game1)
-                white1.elo, black1.elo = EloCalculator.update_ratings(
-                    white1.elo, black1.elo, game1.result
-                )
-                print(f"  {white1.label} vs. {black1.label}: {['0-1', '1/2-1/2', '1-0'][int(game1.result * 2)]}")
-                self.completed_games.add((white1.label, black1.label))
-                self.save_state()
-
-            if (black1.label, white1.label) not in self.completed_games:
-                game2 = self.play_game(black1, white1)
-                self.games.append(game2)
-                black1.elo, white1.elo = EloCalculator.update_ratings(
-                    black1.elo, white1.elo, game2.result
-                )
-                print(f"  {black1.label} vs. {white1.label}: {['0-1', '1/2-1/2', '1-0'][int(game2.result * 2)]}")
-                self.completed_games.add((black1.label, white1.label))
-                self.save_state()
+            schedule.append((white1, black1))
+            schedule.append((black1, white1))
+
+        return [(w, b) for w, b in schedule if not self._is_completed(w, b)]
 
+    def _record_result(self, game: Game):
+        with self._lock:
+            self.games.append(game)
+            game.white.elo, game.black.elo = EloCalculator.update_ratings(
+                game.white.elo, game.black.elo, game.result
+            )
+            print(f"  {game.white.label} vs. {game.black.label}: {_RESULT_STRINGS[int(game.result * 2)]}")
+            self._mark_completed(game.white, game.black)
+            self.save_state()
+
+    def _print_rankings(self):
         print("\nFinal ELO Rankings:")
         for player in sorted(self.players, key=lambda p: -p.elo):
             print(f"{player.label}: {player.elo:.0f}")
 
-    def save_configs(self, path: Path = Path("model_configs.json")):
-        with open(path, 'w') as f:
-            json.dump([p.to_dict() for p in self.players], f, indent=2)
+    def run(self):
+        max_workers = self.max_concurrency or max(len(self.players) * 2, 1)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {executor.submit(self.play_game, white, black): (white, black) for white, black in self._schedule()}
+        failure: Optional[Exception] = None
+        try:
+            for future in as_completed(futures):
+                pairing = futures.pop(future)
+                try:
+                    game = future.result()
+                except Exception as exc:
+                    self._report_failure(*pairing, exc)
+                    failure = exc
+                    break
+                self._record_result(game)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if failure is not None:
+            for future in as_completed([f for f in futures if not f.cancelled()]):
+                try:
+                    self._record_result(future.result())
+                except Exception as exc:
+                    self._report_failure(*futures[future], exc)
+            raise failure
+
+        self._print_rankings()
+
+    def _report_failure(self, white: ModelConfig, black: ModelConfig, exc: BaseException):
+        with self._lock:
+            sys.stderr.write(f"  {white.label} vs. {black.label}: failed ({exc!r})\n")
+
+    async def arun(self):
+        schedule = self._schedule()
+        semaphore = asyncio.Semaphore(self.max_concurrency or max(len(schedule), 1))
+
+        failures: List[Exception] = []
+
+        async def play_bounded(white: ModelConfig, black: ModelConfig) -> Optional[Game]:
+            async with semaphore:
+                if failures:
+                    return None
+                try:
+                    return await self.aplay_game(white, black)
+                except Exception as exc:
+                    self._report_failure(white, black, exc)
+                    failures.append(exc)
+                    return None
+
+        for finished in asyncio.as_completed([play_bounded(white, black) for white, black in schedule]):
+            game = await finished
+            if game is not None:
+                self._record_result(game)
+
+        if failures:
+            raise failures[0]
+
+        self._print_rankings()
 
-    def save_state(self, path: Path = Path("league_state.json")):
-            state = {
+    def save_configs(self, path: Path = Path("model_configs.json")):
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps([p.to_dict() for p in self.players], option=orjson.OPT_INDENT_2))
+
+    def save_state(self, path: Path = Path("league_header.json"), *, games_path: Path = Path("games.jsonl"),
+                   reasonings_path: Path = Path("reasonings.jsonl.gz")):
+            new_games = self.games[self._saved_games:]
+            if new_games or not self._saved_games:
+                hot, cold = [], []
+                for game_id, game in enumerate(new_games, self._saved_games):
+                    record = game.to_dict()
+                    blobs = {'id': game_id}
+                    for key in _COLD_FIELDS:
+                        if key in record:
+                            blobs[key] = record.pop(key)
+                    record['id'] = game_id
+                    hot.append(orjson.dumps(record) + b'\n')
+                    cold.append(orjson.dumps(blobs) + b'\n')
+
+                flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if self._saved_games else os.O_TRUNC)
+                fd = os.open(games_path, flags, 0o644)
+                try:
+                    os.write(fd, b''.join(hot))
+                finally:
+                    os.close(fd)
+                with gzip.open(reasonings_path, 'ab' if self._saved_games else 'wb') as f:
+                    f.write(b''.join(cold))
+                self._saved_games = len(self.games)
+
+            # The header goes last: a crash in between loses at most the rating update, whereas
+            # ratings ahead of the log would count a game that a resume plays and rates again
+            header = {
                 'players': [p.to_dict() for p in self.players],
-                'games': [g.to_dict() for g in self.games],
-                'completed_games': list(self.completed_games),
                 'max_retries' : self.max_retries
             }
-            with open(path, 'w') as f:
-                json.dump(state, f, indent=2)
+            with open(path, 'wb') as f:
+                f.write(orjson.dumps(header, option=orjson.OPT_INDENT_2))
 
     @classmethod
-    def load_state(cls, path: Path = Path("league_state.json"), stringifier: Optional[Callable] = None):
-        with open(path, 'r') as f:
-            state = json.load(f)
+    def load_state(cls, path: Path = Path("league_header.json"), stringifier: Optional[Callable] = None, *, games_path: Path = Path("games.jsonl"),
+                   reasonings_path: Path = Path("reasonings.jsonl.gz"), load_reasonings: bool = True,
+                   legacy_path: Path = Path("league_state.json")):
+        legacy = not path.exists() and legacy_path.exists()
+        with open(legacy_path if legacy else path, 'rb') as f:
+            state = orjson.loads(f.read())
 
         players: List[ModelConfig] = []
         player_map: Dict[str, ModelConfig] = {}
@@ -183,11 +372,32 @@ class League:
 
         league = cls(players=players, max_retries=state['max_retries'], stringifier=stringifier)
 
-        for game_data in state['games']:
-            game = Game.from_dict(game_data, player_map)
-            league.games.append(game)
-
-        league.completed_games = {tuple(m) for m in state['completed_games']}
+        if legacy:
+            for data in state['games']:
+                game = Game(player_map[data['white_label']], player_map[data['black_label']],
+                            moves=data['moves'], reasonings=data['reasonings'], result=data['result'])
+                league.games.append(game)
+                league._mark_completed(game.white, game.black)
+            league.save_state(path, games_path=games_path, reasonings_path=reasonings_path)
+            return league
+
+        blobs: Dict[int, dict] = {}
+        if load_reasonings and reasonings_path.exists():
+            with gzip.open(reasonings_path, 'rb') as f:
+                for line in f:
+                    entry = orjson.loads(line)
+                    blobs[entry.pop('id')] = entry
+
+        if games_path.exists():
+            with open(games_path, 'rb') as f:
+                for line in f:
+                    data = orjson.loads(line)
+                    data.update(blobs.get(data.get('id'), ()))
+                    game = Game.from_dict(data, player_map)
+                    league.games.append(game)
+                    league._mark_completed(game.white, game.black)
+
+        league._saved_games = len(league.games)
 
         return league
 
@@ -196,32 +406,33 @@ class League:
         game = self.games[-1]
         game_idx = len(self.games)
         with open(path / f"game_{game_idx}.pgn", 'w') as f:
-            print(game.to_pgn(), file=f)
+            f.write(game.pgn_text() + '\n')
+
+    def export_pgns(self, path: Path = Path("pgn") / "games.pgn"):
+        path.parent.mkdir(exist_ok= True)
+        path.write_text('\n\n'.join(game.pgn_text() for game in self.games) + '\n')
 
 
 if __name__ == '__main__':
-    stringifier: Callable[[chess.Board], str] = lambda x: x.fen()
+    stringifier: Callable[[chess.Board], str] = _cached_fen
 
     INSTRUCTIONS = 'Analyse the chess position and provide the best move'
 
-    gemini_thinking = ModelConfig(
-        provider= ProviderType.GEMINI,
+    gemini_thinking = ModelConfig.for_gemini(
         api_name= 'gemini-2.5-pro',
         label= 'gemini-2.5-pro-thinking',
         is_reasoning= True,
         instructions= INSTRUCTIONS
     )
 
-    o3 = ModelConfig(
-        provider= ProviderType.OPENAI,
+    o3 = ModelConfig.for_openai(
         api_name='gpt-5',
         label='gpt-5',
         is_reasoning= True,
         instructions=INSTRUCTIONS
     )
 
-    opus = ModelConfig(
-        provider = ProviderType.ANTHROPIC,
+    opus = ModelConfig.for_anthropic(
         api_name= 'claude-opus-4-1-20250805',
         label= 'claude-opus-4.1-thinking',
         instructions= INSTRUCTIONS
@@ -232,4 +443,4 @@ if __name__ == '__main__':
         stringifier=stringifier
     )
 
-    arena.run()
+    asyncio.run(arena.arun())
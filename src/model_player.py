@@ -1,35 +1,172 @@
 import random
+import threading
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
 from models import ProviderType, ModelConfig, build_provider
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Callable
+from typing import Any, Dict, Hashable, List, Tuple, Callable, Optional
 from chess import Board, Move
 
+class LRUCache():
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def position_key(board: Board) -> Hashable:
+    return board._transposition_key()
+
+
+_SAN_TABLES = LRUCache()
+
+def legal_san_table(board: Board) -> Dict[str, Tuple[str, Move]]:
+    key = position_key(board)
+    table = _SAN_TABLES.get(key)
+    if table is None:
+        table = {}
+        for move in board.legal_moves:
+            san = board.san(move)
+            table[san.rstrip('+#')] = (san, move)
+        _SAN_TABLES.put(key, table)
+    return table
+
+class ResponseCache():
+    def __init__(self, path: Optional[Path] = None, maxsize: int = 65536):
+        self._entries = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key BLOB PRIMARY KEY, move TEXT NOT NULL, reasoning TEXT NOT NULL)')
+            self._db.commit()
+
+    @staticmethod
+    def _key(board: Board, request: bytes, context: str) -> bytes:
+        digest = hashlib.blake2b(request, digest_size=16)
+        digest.update(repr(position_key(board)).encode())
+        digest.update(context.encode())
+        return digest.digest()
+
+    def get(self, board: Board, request: bytes, context: str) -> Optional[Tuple[str, str]]:
+        key = self._key(board, request, context)
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            with self._lock:
+                row = self._db.execute('SELECT move, reasoning FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                entry = (row[0], row[1])
+                self._entries.put(key, entry)
+        return entry
+
+    def put(self, board: Board, request: bytes, context: str, move: Move, reasoning: str):
+        key = self._key(board, request, context)
+        entry = (move.uci(), reasoning)
+        self._entries.put(key, entry)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', (key, *entry))
+                self._db.commit()
+
+
 class ModelPlayer():
-    def __init__(self, config: ModelConfig,  max_retries: int, stringifier: Callable[[Board], str]):
+    def __init__(self, config: ModelConfig,  max_retries: int, stringifier: Callable[[Board], str], cache: Optional[ResponseCache] = None):
         self.max_retries = max_retries
         self.stringifier = stringifier
         self.cfg = config
+        self.cache = cache
         self.client = build_provider(config)
 
-    def get_move(self, board: Board, move_history: str) -> Tuple[Move, str]:
+    def _cached_move(self, board: Board, context: str) -> Optional[Tuple[Move, str, str]]:
+        if self.cache is None:
+            return None
+        cached = self.cache.get(board, self.client.fingerprint, context)
+        if cached is None:
+            return None
+        uci, reasoning = cached
+        move = Move.from_uci(uci)
+        return move, board.san(move), reasoning
+
+    def _accept(self, board: Board, context: str, move_str: str, reasoning_str: str) -> Tuple[Move, str]:
+        entry = legal_san_table(board).get(move_str.strip().rstrip('+#!?'))
+        if entry is not None:
+            san, legal_move = entry
+        else:
+            legal_move = board.parse_san(move_str)
+            san = board.san(legal_move)
+        if self.cache is not None:
+            self.cache.put(board, self.client.fingerprint, context, legal_move, reasoning_str)
+        return legal_move, san
+
+    def _context(self, board_str: str, failed_attempts: List[str], move_history: str) -> str:
+        if failed_attempts:
+            return board_str + f"\nIllegal moves in this position:\n" + '\n'.join(failed_attempts) + 'Move history: \n' + move_history
+        return board_str + 'Move history: \n' + move_history
+
+    def _fallback(self, board: Board, failed_attempts: List[str]) -> Tuple[Move, str, str]:
+        fallback_move = random.choice(list(board.legal_moves))
+
+        return fallback_move, board.san(fallback_move), 'Fallback move, ' + f'Failed attempts: {' '.join(failed_attempts)}'
+
+    def get_move(self, board: Board, move_history: List[str]) -> Tuple[Move, str, str]:
+        history = ''.join(move_history)
+        board_str = self.stringifier(board) + '\n'
+        context = self._context(board_str, [], history)
+        cached = self._cached_move(board, context)
+        if cached is not None:
+            return cached
+
         failed_attempts: List[str] = []
 
         for _ in range(self.max_retries):
-            if failed_attempts:
-                ctx = self.stringifier(board) + '\n' + f"\nIllegal moves in this position:\n" + '\n'.join(failed_attempts) + 'Move history: \n' + move_history
-            else:
-                ctx = self.stringifier(board) + '\n' + 'Move history: \n' + move_history
-
+            ctx = self._context(board_str, failed_attempts, history)
             move_str, reasoning_str = self.client.call(context= ctx)
 
             try:
-                legal_move = board.parse_san(move_str)
-                return legal_move, reasoning_str
+                legal_move, san = self._accept(board, context, move_str, reasoning_str)
+                return legal_move, san, reasoning_str
 
             except ValueError:
                 failed_attempts.append(move_str)
 
-        fallback_move = random.choice(list(board.legal_moves))
+        return self._fallback(board, failed_attempts)
+
+    async def aget_move(self, board: Board, move_history: List[str]) -> Tuple[Move, str, str]:
+        history = ''.join(move_history)
+        board_str = self.stringifier(board) + '\n'
+        context = self._context(board_str, [], history)
+        cached = self._cached_move(board, context)
+        if cached is not None:
+            return cached
+
+        failed_attempts: List[str] = []
+
+        for _ in range(self.max_retries):
+            ctx = self._context(board_str, failed_attempts, history)
+            move_str, reasoning_str = await self.client.acall(context= ctx)
+
+            try:
+                legal_move, san = self._accept(board, context, move_str, reasoning_str)
+                return legal_move, san, reasoning_str
+
+            except ValueError:
+                failed_attempts.append(move_str)
 
-        return fallback_move, 'Fallback move, ' + f'Failed attempts: {' '.join(failed_attempts)}'
+        return self._fallback(board, failed_attempts)
@@ -1,14 +1,20 @@
 from enum import Enum
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple, Any
+from typing import Dict, Optional, Tuple, Any, Iterator, AsyncIterator, TYPE_CHECKING
 from abc import ABC, abstractmethod
-from openai import OpenAI
-from anthropic import Anthropic
-from google import genai
-from google.genai import types as gtypes
+from functools import cache
 import json
+import re
+import hashlib
+import orjson
+import asyncio
 from chess import Board, Move
 
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+    from anthropic import Anthropic, AsyncAnthropic
+    from google import genai
+
 CHESS_SCHEMA = {
     "type": "object",
     "properties": {
@@ -28,6 +34,34 @@ CHESS_SCHEMA_WITH_REASONING = {
     "additionalProperties": False
 }
 
+_SCHEMA_JSON: Dict[bool, str] = {
+    False: json.dumps(CHESS_SCHEMA),
+    True: json.dumps(CHESS_SCHEMA_WITH_REASONING)
+}
+
+_GEMINI_SCHEMA: Dict[bool, Dict[str, Any]] = {
+    is_COT: {k: v for k, v in schema.items() if k != 'additionalProperties'}
+    for is_COT, schema in ((False, CHESS_SCHEMA), (True, CHESS_SCHEMA_WITH_REASONING))
+}
+
+_SAN_FIELD = re.compile(r'"chess_move_SAN"\s*:\s*"([^"]*)"')
+
+def _first_san(deltas: Iterator[str]) -> Optional[str]:
+    buffer = ''
+    for delta in deltas:
+        buffer += delta
+        if (match := _SAN_FIELD.search(buffer)):
+            return match.group(1)
+    return None
+
+async def _afirst_san(deltas: AsyncIterator[str]) -> Optional[str]:
+    buffer = ''
+    async for delta in deltas:
+        buffer += delta
+        if (match := _SAN_FIELD.search(buffer)):
+            return match.group(1)
+    return None
+
 HIGH_THINKING: int = 5000
 MEDIUM_THINKING: int = 2000
 LOW_THINKING: int = 1024
@@ -37,7 +71,7 @@ class ProviderType(Enum):
     ANTHROPIC = 'Anthropic'
     GEMINI = 'Gemini'
 
-@dataclass
+@dataclass(slots=True)
 class ModelConfig:
     provider: ProviderType
     api_name: str
@@ -49,15 +83,30 @@ class ModelConfig:
     max_tokens: int = 2000
     thinking_effort: str = 'medium'
 
-    def __post_init__(self):
-        if self.is_COT and self.is_reasoning:
-            raise AssertionError('Models must be reasoning XOR CoT')
 
-        if self.provider == ProviderType.OPENAI:
-            if self.max_tokens < 2000:
-                self.thinking_effort = 'low'
-            elif self.max_tokens >=5000:
-                self.thinking_effort = 'high'
+    @classmethod
+    def _checked(cls, **fields: Any) -> 'ModelConfig':
+        if fields.get('is_COT') and fields.get('is_reasoning'):
+            raise AssertionError('Models must be reasoning XOR CoT')
+        return cls(**fields)
+
+    @classmethod
+    def for_openai(cls, api_name: str, label: str, instructions: str, max_tokens: int = 2000, **kwargs: Any) -> 'ModelConfig':
+        thinking_effort = kwargs.pop('thinking_effort', 'medium')
+        if max_tokens < 2000:
+            thinking_effort = 'low'
+        elif max_tokens >= 5000:
+            thinking_effort = 'high'
+        return cls._checked(provider=ProviderType.OPENAI, api_name=api_name, label=label, instructions=instructions,
+                            max_tokens=max_tokens, thinking_effort=thinking_effort, **kwargs)
+
+    @classmethod
+    def for_anthropic(cls, api_name: str, label: str, instructions: str, **kwargs: Any) -> 'ModelConfig':
+        return cls._checked(provider=ProviderType.ANTHROPIC, api_name=api_name, label=label, instructions=instructions, **kwargs)
+
+    @classmethod
+    def for_gemini(cls, api_name: str, label: str, instructions: str, **kwargs: Any) -> 'ModelConfig':
+        return cls._checked(provider=ProviderType.GEMINI, api_name=api_name, label=label, instructions=instructions, **kwargs)
 
     def __hash__(self) -> int:
         return hash((self.provider.value, self.api_name, self.is_reasoning, self.is_COT, self.instructions, self.max_tokens))
@@ -76,87 +125,129 @@ class ModelConfig:
        }
 
 
+@cache
+def get_openai_client() -> 'OpenAI':
+    from openai import OpenAI
+    return OpenAI()
+
+@cache
+def get_async_openai_client() -> 'AsyncOpenAI':
+    from openai import AsyncOpenAI
+    return AsyncOpenAI()
+
+@cache
+def get_anthropic_client() -> 'Anthropic':
+    from anthropic import Anthropic
+    return Anthropic()
+
+@cache
+def get_async_anthropic_client() -> 'AsyncAnthropic':
+    from anthropic import AsyncAnthropic
+    return AsyncAnthropic()
+
+@cache
+def get_gemini_client() -> 'genai.Client':
+    from google import genai
+    return genai.Client()
+
+
+def _fingerprint(provider: ProviderType, template: bytes) -> bytes:
+    return hashlib.blake2b(provider.value.encode() + b'\0' + template, digest_size=16).digest()
+
+
 class ModelProvider(ABC):
+    fingerprint: bytes
+
     @abstractmethod
     def call(self, context: str) -> Tuple[str, str]:
         pass
 
+    async def acall(self, context: str) -> Tuple[str, str]:
+        return await asyncio.to_thread(self.call, context)
+
 
 class OpenAIProvider(ModelProvider):
     def __init__(self, config: ModelConfig) -> None:
-        self.client = OpenAI()
+        self.client = get_openai_client()
+        self.async_client = get_async_openai_client()
         self.config = config
+        self._answer_only = not (config.is_reasoning or config.is_COT)
         assert (config.provider == ProviderType.OPENAI)
 
-    def call(self, context: str) -> Tuple[str, str]:
-        kwargs = {
-            "model": self.config.api_name,
-            "input": context,
-            "instructions": self.config.instructions,
+        self._base_kwargs: Dict[str, Any] = {
+            "model": config.api_name,
+            "instructions": config.instructions,
             "text": {
                 "format": {
                     "type": "json_schema",
                     "name": "chess_schema",
-                    "schema": {},
+                    "schema": CHESS_SCHEMA_WITH_REASONING if config.is_COT else CHESS_SCHEMA,
                     "strict": True
                 }
             }
         }
+        if config.is_reasoning:
+            self._base_kwargs["reasoning"] = {'effort': config.thinking_effort}
+        self.fingerprint = _fingerprint(config.provider, orjson.dumps(self._base_kwargs, option=orjson.OPT_SORT_KEYS))
 
-        if self.config.is_reasoning:
-            kwargs["reasoning"] = {'effort': self.config.thinking_effort}
-            kwargs['text']['format']['schema'] = CHESS_SCHEMA
-
-        elif self.config.is_COT:
-            kwargs['text']['format']['schema'] = CHESS_SCHEMA_WITH_REASONING
+    def _build_kwargs(self, context: str) -> Dict[str, Any]:
+        kwargs = self._base_kwargs.copy()
+        kwargs['input'] = context
+        return kwargs
 
-        else:
-            kwargs['text']['format']['schema'] = CHESS_SCHEMA
-
-        response = self.client.responses.create(**kwargs)
-        parsed_response = json.loads(response.output_text)
+    def _parse(self, response) -> Tuple[str, str]:
+        parsed_response = orjson.loads(response.output_text)
         move = parsed_response['chess_move_SAN']
         reasoning = parsed_response['reasoning'] if self.config.is_COT else response.reasoning.summary if self.config.is_reasoning else 'No reasoning'
 
         return move, reasoning
 
+    def call(self, context: str) -> Tuple[str, str]:
+        with self.client.responses.stream(**self._build_kwargs(context)) as stream:
+            if self._answer_only:
+                san = _first_san(event.delta for event in stream if event.type == 'response.output_text.delta')
+                if san is not None:
+                    return san, 'No reasoning'
+            return self._parse(stream.get_final_response())
+
+    async def acall(self, context: str) -> Tuple[str, str]:
+        async with self.async_client.responses.stream(**self._build_kwargs(context)) as stream:
+            if self._answer_only:
+                san = await _afirst_san(event.delta async for event in stream if event.type == 'response.output_text.delta')
+                if san is not None:
+                    return san, 'No reasoning'
+            return self._parse(await stream.get_final_response())
+
 
 class AnthropicProvider(ModelProvider):
     def __init__(self, config: ModelConfig) -> None:
-        self.client = Anthropic()
+        self.client = get_anthropic_client()
+        self.async_client = get_async_anthropic_client()
         self.config = config
+        self._answer_only = not (config.is_reasoning or config.is_COT)
+        self._prompt_suffix = '\n\nFormat your response as valid JSON matching this schema. Respond only with JSON: ' + _SCHEMA_JSON[config.is_COT]
 
-    def call(self, context: str) -> Tuple[str, str]:
-        kwargs = {
-            'model': self.config.api_name,
-            'system': self.config.instructions,
-            'messages': [
-                {'role': 'user', 'content': ''},
-            ],
-            'max_tokens': self.config.max_tokens + 6
+        self._base_kwargs: Dict[str, Any] = {
+            'model': config.api_name,
+            'system': config.instructions,
+            'max_tokens': config.max_tokens + 6
         }
+        if config.is_reasoning:
+            self._base_kwargs['thinking'] = {'type': 'enabled', 'budget_tokens': config.max_tokens}
+        self.fingerprint = _fingerprint(config.provider, orjson.dumps({**self._base_kwargs, 'prompt_suffix': self._prompt_suffix}, option=orjson.OPT_SORT_KEYS))
 
-        user_message = f'{context}\n\nFormat your response as valid JSON matching this schema. Respond only with JSON: '
-
-        if self.config.is_reasoning:
-            kwargs['thinking'] = {'type': 'enabled', 'budget_tokens': self.config.max_tokens}
-            user_message += json.dumps(CHESS_SCHEMA)
-
-        elif self.config.is_COT:
-            user_message += json.dumps(CHESS_SCHEMA_WITH_REASONING)
+    def _build_kwargs(self, context: str) -> Dict[str, Any]:
+        kwargs = self._base_kwargs.copy()
+        kwargs['messages'] = [{'role': 'user', 'content': context + self._prompt_suffix}]
+        return kwargs
 
-        else:
-            user_message += json.dumps(CHESS_SCHEMA)
-
-        kwargs["messages"][0]['content'] = user_message
-
-        response = self.client.messages.create(**kwargs)
+    def _parse(self, response) -> Tuple[str, str]:
         text_content = ''
         for block in response.content:
             if block.type == 'text':
                 text_content = block.text
                 break
-        parsed_response = json.loads(text_content)
+        parsed_response = orjson.loads(text_content)
 
         move = parsed_response['chess_move_SAN']
         reasoning = (
@@ -166,38 +257,47 @@ class AnthropicProvider(ModelProvider):
             )
         return move, reasoning
 
+    def call(self, context: str) -> Tuple[str, str]:
+        with self.client.messages.stream(**self._build_kwargs(context)) as stream:
+            if self._answer_only:
+                san = _first_san(stream.text_stream)
+                if san is not None:
+                    return san, 'None'
+            return self._parse(stream.get_final_message())
+
+    async def acall(self, context: str) -> Tuple[str, str]:
+        async with self.async_client.messages.stream(**self._build_kwargs(context)) as stream:
+            if self._answer_only:
+                san = await _afirst_san(stream.text_stream)
+                if san is not None:
+                    return san, 'None'
+            return self._parse(await stream.get_final_message())
+
 class GeminiProvider(ModelProvider):
     def __init__(self, config: ModelConfig) -> None:
-        self.client = genai.Client()
+        from google.genai import types as gtypes
+        self.client = get_gemini_client()
         self.config = config
 
-    def call(self, context: str) -> Tuple[str, str]:
-        kwargs = {
-            'model': self.config.api_name,
-            'contents': context,
-            'config': gtypes.GenerateContentConfig(
-                system_instruction=self.config.instructions,
-                response_mime_type="application/json",
-                max_output_tokens=self.config.max_tokens
-            )
-        }
-
-        if self.config.is_reasoning:
-            kwargs['config'].thinking_config = gtypes.ThinkingConfig(
-                thinking_budget=self.config.max_tokens,
+        # Built once and shared by every call. The SDK normalises the schema in place, but only
+        # by adding property_ordering, so reuse is stable; the constructor copies the module schema
+        self._generation_config = gtypes.GenerateContentConfig(
+            system_instruction=config.instructions,
+            response_mime_type="application/json",
+            max_output_tokens=config.max_tokens,
+            response_schema=_GEMINI_SCHEMA[config.is_COT]
+        )
+        if config.is_reasoning:
+            self._generation_config.thinking_config = gtypes.ThinkingConfig(
+                thinking_budget=config.max_tokens,
                 include_thoughts=True
             )
-            kwargs['config'].response_schema = CHESS_SCHEMA.copy()
-
-        elif self.config.is_COT:
-            kwargs['config'].response_schema = CHESS_SCHEMA_WITH_REASONING.copy()
-
-        else:
-            kwargs['config'].response_schema = CHESS_SCHEMA.copy()
+        self.fingerprint = _fingerprint(config.provider, config.api_name.encode() + b'\0' + self._generation_config.model_dump_json(exclude_none=True).encode())
 
-        kwargs['config'].response_schema.pop('additionalProperties')
-        response = self.client.models.generate_content(**kwargs)
+    def _build_kwargs(self, context: str) -> Dict[str, Any]:
+        return {'model': self.config.api_name, 'contents': context, 'config': self._generation_config}
 
+    def _parse(self, response) -> Tuple[str, str]:
         text_content = ''
         thought_content = ''
 
@@ -213,7 +313,7 @@ class GeminiProvider(ModelProvider):
             else:
                 text_content += part.text
 
-        parsed_response = json.loads(text_content)
+        parsed_response = orjson.loads(text_content)
         move = parsed_response['chess_move_SAN']
         reasoning = (
             parsed_response['reasoning'] if self.config.is_COT
@@ -222,19 +322,28 @@ class GeminiProvider(ModelProvider):
         )
         return move, reasoning
 
+    def call(self, context: str) -> Tuple[str, str]:
+        response = self.client.models.generate_content(**self._build_kwargs(context))
+        return self._parse(response)
+
+    async def acall(self, context: str) -> Tuple[str, str]:
+        response = await self.client.aio.models.generate_content(**self._build_kwargs(context))
+        return self._parse(response)
+
+_PROVIDERS: Dict[ProviderType, type] = {
+    ProviderType.ANTHROPIC: AnthropicProvider,
+    ProviderType.OPENAI: OpenAIProvider,
+    ProviderType.GEMINI: GeminiProvider
+}
+
 def build_provider(cfg: ModelConfig):
-    if cfg.provider == ProviderType.ANTHROPIC:
-        return AnthropicProvider(cfg)
-    elif cfg.provider == ProviderType.OPENAI:
-        return OpenAIProvider(cfg)
-    elif cfg.provider == ProviderType.GEMINI:
-        return GeminiProvider(cfg)
-    else:
-        raise ValueError('Unsupported ProviderTypek')
+    provider_cls = _PROVIDERS.get(cfg.provider)
+    if provider_cls is None:
+        raise ValueError('Unsupported ProviderType')
+    return provider_cls(cfg)
 
 if __name__ == '__main__':
-    gemini_thinking_cfg = ModelConfig(
-        provider= ProviderType.GEMINI,
+    gemini_thinking_cfg = ModelConfig.for_gemini(
         api_name= 'gemini-2.5-flash',
         label= 'gemini-2.5-flash thinking',
         is_reasoning= True,